@@ -1,11 +1,19 @@
 """Functions that interacts with the CA"""
+import os
+import re
+import Queue
+import hashlib
 import logging
 from collections import namedtuple
+from multiprocessing.dummy import Pool as ThreadPool
 
 import josepy as jose
+from requests.adapters import HTTPAdapter
 from acme import client
 from acme import messages
+from acme import challenges as acme_challenges
 from acme import errors as acme_errors
+from cryptography import x509
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import serialization
 
@@ -13,6 +21,36 @@ import OpenSSL
 
 logger = logging.getLogger(__name__)
 
+# max number of simultaneous connections against the CA
+MAX_PARALLEL_REQUESTS = 16
+
+_Authz = namedtuple("Authz", ["domain", "validation", "response", "challenge"])
+
+# the loaded account keys, cached as (path, mtime) -> JWKRSA
+_account_key_cache = {}
+
+def _load_account_key(path):
+    """Loads the account key from disk, with caching
+
+    Loading an RSA key is surprisingly expensive, and the same key is
+    loaded every time the class is instantiated, so we cache the loaded
+    key. The mtime is part of the cache key, so a replaced key file
+    will be picked up.
+    """
+    cache_key = (path, os.stat(path).st_mtime)
+    try:
+        return _account_key_cache[cache_key]
+    except KeyError:
+        with open(path, "r") as key_file:
+            private_key = serialization.load_pem_private_key(
+                key_file.read(),
+                password=None,
+                backend=default_backend()
+                )
+        key = jose.JWKRSA(key=private_key)
+        _account_key_cache[cache_key] = key
+        return key
+
 
 class CAError(Exception):
     """Superclass for all ca exceptions."""
@@ -26,92 +64,190 @@ class GetCertificateFailedError(CAError):
 class UnknownValidationType(CAError):
     """Raised when the validation type is not recognized"""
     pass
+class ReceivedInvalidCertificateError(CAError):
+    """Raised when the certificate from the CA contains something it shouldn't"""
+    pass
 
 class CertificateAuthority(object):
     """Represent a Certificate Authority"""
 
     def __init__(self, configuration, test=False):
+        self._configuration = configuration
+        self._test = test
+        self._key = None
+        self._client = None
+        # reuse the connections to the CA, so that we don't have to do
+        # a full TLS handshake for every request. The adapter is shared
+        # between all the sessions, so they use the same pool.
+        self._adapter = HTTPAdapter(
+            pool_connections=4, pool_maxsize=MAX_PARALLEL_REQUESTS * 2)
         if test:
-            self.key = None
-        else:
-            with open(configuration.cm_key, "r") as key_file:
-                private_key = serialization.load_pem_private_key(
-                    key_file.read(),
-                    password=None,
-                    backend=default_backend()
-                    )
-            self.key = jose.JWKRSA(key=private_key)
+            # constructing the client fetches the directory from the CA,
+            # which is exactly what the connectivity test is after
+            self.client # pylint: disable=pointless-statement
+
+    @property
+    def key(self):
+        """The account key, loaded on first use"""
+        if self._key is None and not self._test:
+            self._key = _load_account_key(self._configuration.cm_key)
+        return self._key
+
+    @property
+    def client(self):
+        """The ACME client, created on first use
+
+        Creating the client fetches the directory from the CA (a
+        network round-trip), so it is deferred until it is needed.
+        """
+        if self._client is None:
+            network = self._make_network()
+            directory = messages.Directory.from_json(
+                network.get(self._configuration.ca).json())
+            self._client = client.ClientV2(directory, net=network)
+        return self._client
+
+    def _make_network(self):
+        """Creates a ClientNetwork that uses the shared connection pool"""
         user_agent = 'bigacme (https://github.com/magnuswatn/bigacme/)'
         network = client.ClientNetwork(self.key, user_agent=user_agent)
-        network.session.proxies = {'https': configuration.ca_proxy}
-        acme_client = client.Client(directory=configuration.ca, key=self.key, net=network)
-        self.client = acme_client
+        network.session.mount('https://', self._adapter)
+        network.session.mount('http://', self._adapter)
+        network.session.proxies = {'https': self._configuration.ca_proxy}
+        if self._configuration.ca_proxy:
+            # the proxy is explicitly configured, so don't
+            # look it up in the environment for every request
+            network.session.trust_env = False
+        return network
+
+    def _ensure_registered(self):
+        """Makes sure the client knows about our account with the CA
+
+        ACME v2 signs most requests with the account URL, so we must
+        look it up before we can order certificates.
+        """
+        if self.client.net.account is None:
+            registration = messages.NewRegistration(only_return_existing=True)
+            try:
+                self.client.new_account(registration)
+            except acme_errors.ConflictError as error:
+                # the account exists, which is what we wanted to know
+                self.client.net.account = messages.RegistrationResource(
+                    uri=error.location)
 
     def register(self, mail):
         """Registers an account with the ca"""
-        registration = messages.NewRegistration.from_data(email=mail)
-        regr = self.client.register(registration)
-        logger.info("Auto-accepting TOS: %s", regr.terms_of_service)
-        self.client.agree_to_tos(regr)
+        registration = messages.NewRegistration.from_data(
+            email=mail, terms_of_service_agreed=True)
+        logger.info("Auto-accepting TOS: %s",
+                    self.client.directory.meta.terms_of_service)
+        self.client.new_account(registration)
         logger.info("Registered with the CA")
 
-    def get_challenge_for_domains(self, hostnames, typ):
-        """Asks the CA for challenges for the specified domains"""
-        authz = []
-        for hostname in hostnames:
-            authz += [self.client.request_domain_challenges(hostname)]
-        desired_challenges = _return_desired_challenges(authz, typ)
-        return self.return_tuple_from_challenges(desired_challenges), authz
+    def get_challenge_for_domains(self, csr_pem, typ):
+        """Orders a certificate and returns the challenges for it"""
+        self._ensure_registered()
+        order = self.client.new_order(str(csr_pem))
+        desired_challenges = _return_desired_challenges(order.authorizations, typ)
+        return self.return_tuple_from_challenges(desired_challenges), order
 
     def answer_challenges(self, challenges):
         """Tells the CA that the challenges has been solved"""
-        for challenge in challenges:
+        # a ClientNetwork keeps its nonces in a plain set, which is not
+        # safe to share between threads, so each worker gets its own
+        # client (with the same account and connection pool)
+        directory = self.client.directory
+        account = self.client.net.account
+        pool_size = min(len(challenges), MAX_PARALLEL_REQUESTS) or 1
+        clients = Queue.Queue()
+        for _ in range(pool_size):
+            network = self._make_network()
+            network.account = account
+            clients.put(client.ClientV2(directory, net=network))
+
+        def _answer_challenge(challenge):
             logger.debug("Answering challenge for the domain: %s", challenge.domain)
-            self.client.answer_challenge(challenge.challenge, challenge.response)
+            acme_client = clients.get()
+            try:
+                acme_client.answer_challenge(challenge.challenge, challenge.response)
+            finally:
+                clients.put(acme_client)
+
+        pool = ThreadPool(pool_size)
+        try:
+            pool.map(_answer_challenge, challenges)
+        finally:
+            pool.close()
+            pool.join()
 
     def revoke_certifciate(self, cert_pem, reason):
         """Revokes a certificate"""
-        cert = OpenSSL.crypto.load_certificate(OpenSSL.crypto.FILETYPE_PEM, cert_pem)
-        jose_cert = jose.util.ComparableX509(cert)
+        self._ensure_registered()
+        cert = x509.load_pem_x509_certificate(str(cert_pem), default_backend())
+        jose_cert = jose.util.ComparableX509(OpenSSL.crypto.X509.from_cryptography(cert))
         self.client.revoke(jose_cert, reason)
 
-    def get_certificate_from_ca(self, csr_pem, authorizations):
-        """Sends the CSR to the CA and gets a signed certificate in return"""
-        csr = OpenSSL.crypto.load_certificate_request(OpenSSL.crypto.FILETYPE_PEM, csr_pem)
-        jose_csr = jose.util.ComparableX509(csr)
+    def get_certificate_from_ca(self, order):
+        """Finalizes the order and gets the signed certificate from the CA"""
         logger.debug("Getting the certificate from the CA")
         try:
-            certificateresource, _ = self.client.poll_and_request_issuance(jose_csr, authorizations)
-        except acme_errors.PollError as error:
-            if error.timeout:
-                raise GetCertificateFailedError(
-                    "Timed out while waiting for the CA to verify the challenges")
-            else:
-                raise GetCertificateFailedError("The CA could not verify the challenges")
+            order = self.client.poll_and_finalize(order)
+        except acme_errors.TimeoutError:
+            raise GetCertificateFailedError(
+                "Timed out while waiting for the CA to verify the challenges")
+        except acme_errors.ValidationError:
+            raise GetCertificateFailedError("The CA could not verify the challenges")
 
-        cert = certificateresource.body._dump(OpenSSL.crypto.FILETYPE_PEM) # pylint: disable=protected-access
-        chain_certs = self.client.fetch_chain(certificateresource)
-        chain = []
-        for chaincert in chain_certs:
-            chain.append(chaincert._dump(OpenSSL.crypto.FILETYPE_PEM)) # pylint: disable=protected-access
-        return cert, chain
+        _validate_cert_chain(order.fullchain_pem)
+        certs = _CERTIFICATE_PEM.findall(order.fullchain_pem)
+        if not certs:
+            raise GetCertificateFailedError("The CA returned an empty certificate chain")
+        return certs[0], certs[1:]
 
     def return_tuple_from_challenges(self, challenges):
         """Returns a challenge tuple from a list of challenges"""
-        challtp = namedtuple("Authz", ["domain", "validation", "response", "challenge"])
+        # the thumbprint is a hash of our account key, so it is the same
+        # for every challenge - no need to rederive it over and over
+        thumbprint = jose.b64encode(self.key.thumbprint())
         tuples = []
         for challenge in challenges:
-            response, validation = challenge[1].response_and_validation(self.key)
-            tuples += [challtp(domain=challenge[0], validation=validation, response=response,
-                               challenge=challenge[1])]
+            chall = challenge[1].chall
+            key_authorization = '%s.%s' % (chall.encode('token'), thumbprint)
+            if isinstance(chall, acme_challenges.HTTP01):
+                response = chall.response_cls(key_authorization=key_authorization)
+                validation = key_authorization
+            elif isinstance(chall, acme_challenges.DNS01):
+                response = chall.response_cls(key_authorization=key_authorization)
+                validation = jose.b64encode(
+                    hashlib.sha256(key_authorization).digest())
+            else:
+                response, validation = challenge[1].response_and_validation(self.key)
+            tuples.append(_Authz(domain=challenge[0], validation=validation, response=response,
+                                 challenge=challenge[1]))
         return tuples
 
+# PEM markers that have no business being in a certificate chain,
+# compiled into a single pattern so the PEM is only scanned once
+_FORBIDDEN_PEM_MARKERS = re.compile(
+    '-----BEGIN (?:RSA |EC )?PRIVATE KEY-----')
+
+_CERTIFICATE_PEM = re.compile(
+    '-----BEGIN CERTIFICATE-----.+?-----END CERTIFICATE-----\n?', re.DOTALL)
+
+def _validate_cert_chain(pem):
+    """Checks that the PEM from the CA does not contain anything nasty"""
+    match = _FORBIDDEN_PEM_MARKERS.search(pem)
+    if match:
+        raise ReceivedInvalidCertificateError(
+            'The certificate from the CA contained a %s marker' % match.group(0))
+
 def _return_desired_challenges(challenges, typ):
-    desired_challenges = []
-    for challenge in challenges:
-        desired_challenge = [ch for ch in challenge.body.challenges if ch.typ == typ]
-        if desired_challenge:
-            desired_challenges += [[challenge.body.identifier.value, desired_challenge[0]]]
-        else:
+    desired_challenges = [None] * len(challenges)
+    for index, challenge in enumerate(challenges):
+        body = challenge.body
+        desired_challenge = next(
+            (ch for ch in body.challenges if ch.typ == typ), None)
+        if desired_challenge is None:
             raise NoDesiredChallenge('The CA didn\'t provide a %s challenge' % typ)
+        desired_challenges[index] = [body.identifier.value, desired_challenge]
     return desired_challenges
@@ -182,11 +182,9 @@ class Certificate(object):
 
     def get_pem(self, include_chain):
         "Returns the PEM encoded cert, optionally with chain"
-        chain = self.cert
         if include_chain:
-            for cert in self.chain:
-                chain += cert
-        return chain
+            return ''.join([self.cert] + list(self.chain))
+        return self.cert
 
     def delete(self):
         """Removes the certificate from disk"""
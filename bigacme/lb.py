@@ -1,5 +1,6 @@
 """Functions that interacts with the loadbalancer"""
 import logging
+
 import bigsuds
 
 logger = logging.getLogger(__name__)
@@ -48,42 +49,84 @@ class LoadBalancer(object):
             lb1.System.SystemInfo.get_uptime()
             self.bigip = lb1
 
+        # cache the suds proxies, so that they are not resolved
+        # through the WSDL on every call
+        self._session = self.bigip.System.Session
+        self._datagroup = self.bigip.LocalLB.Class
+        self._keycert = self.bigip.Management.KeyCertificate
+        self._active_folder = None
+        self._folder = '/%s' % self.partition
+
+    def _ensure_folder(self, folder):
+        """Sets the active folder, unless it is already the active one"""
+        if folder != self._active_folder:
+            self._session.set_active_folder(folder)
+            self._active_folder = folder
+
+    def send_challenges(self, challenges):
+        """Sends all the challenges to the Big-IP in one batch
+
+        Takes a list of (domain, path, string) tuples and adds them to
+        the datagroup with three SOAP calls in total, instead of three
+        per challenge.
+        """
+        keys = ['%s:%s' % (domain, path.rpartition('/')[2]) for domain, path, _ in challenges]
+        values = [string for _, _, string in challenges]
+        logger.debug('Adding records %s to datagroup %s in partition %s', keys,
+                     self.datagroup, self.partition)
+        self._ensure_folder(self._folder)
+        class_members = [{'name': self.datagroup, 'members': keys}]
+        try:
+            self._datagroup.add_string_class_member(class_members)
+        except bigsuds.ServerError as error:
+            if 'already exists in partition' in error.message:
+                logger.debug('One or more of the records already exist. '
+                             'Deleting them before adding them again')
+                for domain, path, _ in challenges:
+                    try:
+                        self.remove_challenge(domain, path)
+                    except bigsuds.ServerError:
+                        logger.debug('Could not remove record for %s. '
+                                     'It probably did not exist', domain)
+                self._datagroup.add_string_class_member(class_members)
+            else:
+                raise
+        self._datagroup.set_string_class_member_data_value(class_members, [values])
+
     def send_challenge(self, domain, path, string):
         """Sends the challenge to the Big-IP"""
-        shortpath = path.split('/')[-1]
+        shortpath = path.rpartition('/')[2]
         key = '%s:%s' % (domain, shortpath)
         logger.debug('Adding record %s with value %s to datagroup %s in partition %s', key, string,
                      self.datagroup, self.partition)
-        self.bigip.System.Session.set_active_folder('/%s' % self.partition)
-        datagroup = self.bigip.LocalLB.Class
+        self._ensure_folder(self._folder)
         class_members = [{'name': self.datagroup, 'members': [key]}]
         try:
-            datagroup.add_string_class_member(class_members)
+            self._datagroup.add_string_class_member(class_members)
         except bigsuds.ServerError as error:
             if 'The requested class string item (/%s/%s %s) already exists in partition' % (
                     self.partition, self.datagroup, key) in error.message:
                 logger.debug('The record already exist. Deleting it before adding it again')
                 self.remove_challenge(domain, path)
-                datagroup.add_string_class_member(class_members)
+                self._datagroup.add_string_class_member(class_members)
             else:
                 raise
-        datagroup.set_string_class_member_data_value(class_members, [[string]])
+        self._datagroup.set_string_class_member_data_value(class_members, [[string]])
 
     def remove_challenge(self, domain, path):
         """Removes the challenge from the Big-IP"""
-        shortpath = path.split('/')[-1]
+        shortpath = path.rpartition('/')[2]
         key = '%s:%s' % (domain, shortpath)
         logger.debug('Removing record %s from datagroup %s in partition %s', key, self.datagroup,
                      self.partition)
-        self.bigip.System.Session.set_active_folder('/%s' % self.partition)
-        datagroup = self.bigip.LocalLB.Class
+        self._ensure_folder(self._folder)
         class_members = [{'name': self.datagroup, 'members': [key]}]
-        datagroup.delete_string_class_member(class_members)
+        self._datagroup.delete_string_class_member(class_members)
 
     def get_csr(self, partition, csrname):
         """Downloads the specified csr"""
         try:
-            self.bigip.System.Session.set_active_folder('/%s' % partition)
+            self._ensure_folder('/%s' % partition)
         except bigsuds.ServerError as error:
             if 'folder not found' in error.message:
                 raise PartitionNotFoundError()
@@ -92,7 +135,7 @@ class LoadBalancer(object):
             else:
                 raise
         try:
-            pem_csr = self.bigip.Management.KeyCertificate.certificate_request_export_to_pem(
+            pem_csr = self._keycert.certificate_request_export_to_pem(
                 'MANAGEMENT_MODE_DEFAULT', [csrname])[0]
         except bigsuds.ServerError as error:
             if 'Access Denied:' in error.message:
@@ -106,7 +149,7 @@ class LoadBalancer(object):
     def upload_certificate(self, partition, name, certificates, overwrite=True):
         """Uploads a new certificate to the Big-IP"""
         try:
-            self.bigip.System.Session.set_active_folder('/%s' % partition)
+            self._ensure_folder('/%s' % partition)
         except bigsuds.ServerError as error:
             if 'folder not found' in error.message:
                 raise PartitionNotFoundError()
@@ -115,7 +158,7 @@ class LoadBalancer(object):
             else:
                 raise
         try:
-            self.bigip.Management.KeyCertificate.certificate_import_from_pem(
+            self._keycert.certificate_import_from_pem(
                 'MANAGEMENT_MODE_DEFAULT', [name], [certificates], overwrite)
         except bigsuds.ServerError as error:
             if 'Access Denied:' in error.message:
@@ -332,11 +332,11 @@ def _get_new_cert(acme_ca, bigip, csr, dns_plugin):
     logger.debug("The csr has the following hostnames: %s", csr.hostnames)
     logger.debug("Getting the challenges from the CA")
 
-    challenges, authz = acme_ca.get_challenge_for_domains(csr.hostnames, csr.validation_method)
+    challenges, order = acme_ca.get_challenge_for_domains(csr.csr, csr.validation_method)
 
     if csr.validation_method == 'http-01':
-        for challenge in challenges:
-            bigip.send_challenge(challenge.domain, challenge.challenge.path, challenge.validation)
+        bigip.send_challenges([(challenge.domain, challenge.challenge.path, challenge.validation)
+                               for challenge in challenges])
     elif csr.validation_method == 'dns-01':
         for challenge in challenges:
             record_name = challenge.challenge.validation_domain_name(challenge.domain)
@@ -348,7 +348,7 @@ def _get_new_cert(acme_ca, bigip, csr, dns_plugin):
 
     acme_ca.answer_challenges(challenges)
     try:
-        certificate, chain = acme_ca.get_certificate_from_ca(csr.csr, authz)
+        certificate, chain = acme_ca.get_certificate_from_ca(order)
     finally:
         # cleanup
         if csr.validation_method == 'http-01':
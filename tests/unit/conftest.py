@@ -0,0 +1,74 @@
+import os
+import shutil
+
+import pytest
+from cryptography import x509
+from cryptography.x509.oid import NameOID
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+
+FOLDERS = ["config", "cert", "cert/backup"]
+
+_CACHED_KEY = None
+
+def _get_key():
+    """Returns a cached key, as key generation is slow
+
+    The tests only care about the certificate metadata,
+    so they can all share the same key.
+    """
+    global _CACHED_KEY
+    if _CACHED_KEY is None:
+        # an EC key is orders of magnitude faster to generate than an RSA key
+        _CACHED_KEY = ec.generate_private_key(ec.SECP256R1(), default_backend())
+    return _CACHED_KEY
+
+_csr_cache = {}
+
+def _generate_csr(cn, san):
+    """Generates a csr for testing purposes
+
+    Signing a csr is not free, and the tests reuse the same
+    names over and over, so the results are cached.
+    """
+    try:
+        return _csr_cache[(cn, san)]
+    except KeyError:
+        key = _get_key()
+        if cn:
+            subject = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, cn.decode())])
+        else:
+            subject = x509.Name([])
+        builder = x509.CertificateSigningRequestBuilder().subject_name(subject)
+        if san:
+            sans = [x509.DNSName(name.split(':', 1)[1].decode())
+                    for name in san.split(',')]
+            builder = builder.add_extension(
+                x509.SubjectAlternativeName(sans), critical=False)
+        csr = builder.sign(key, hashes.SHA256(), default_backend())
+        pem = csr.public_bytes(serialization.Encoding.PEM)
+        _csr_cache[(cn, san)] = pem
+        return pem
+
+@pytest.fixture(scope="session")
+def default_csr():
+    """The csr most tests use, generated once for the whole session"""
+    return _generate_csr('common-name', 'DNS:san1,DNS:san2')
+
+@pytest.fixture(scope="module", autouse=True)
+def working_dir(tmpdir_factory):
+    """Runs each test module in its own temporary folder structure
+
+    The modules mutate the folders heavily (and test_config removes
+    some of them), so they can not share a single directory.
+    """
+    org_cwd = os.getcwd()
+    temp_dir = str(tmpdir_factory.mktemp("bigacme"))
+    os.chdir(temp_dir)
+    for folder in FOLDERS:
+        os.makedirs(folder)
+    yield temp_dir
+    os.chdir(org_cwd)
+    shutil.rmtree(temp_dir)
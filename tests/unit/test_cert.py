@@ -1,59 +1,64 @@
 import os
-import pwd
 import json
-import shutil
-import tempfile
 from collections import namedtuple
 from datetime import datetime, timedelta
 
 import pytest
-import OpenSSL
+from cryptography import x509
+from cryptography.x509.oid import NameOID
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes, serialization
 
 import bigacme.cert
 
-ORG_CWD = os.getcwd()
+from .conftest import FOLDERS, _generate_csr, _get_key
 
-FOLDERS = ["config", "cert", "cert/backup"]
-
-def setup_module(module):
-    temp_dir = tempfile.mkdtemp()
-    os.chdir(temp_dir)
-    for folder in FOLDERS:
-        os.makedirs(folder)
-
-def teardown_module(module):
-    if '/tmp/' in os.getcwd():
-        shutil.rmtree(os.getcwd())
-    os.chdir(ORG_CWD)
+_cert_cache = {}
+_cert_generated_at = {}
 
 def _generate_certificate(not_before, not_after):
-    """Generates a certificate in a file for testing purposes"""
-    key = OpenSSL.crypto.PKey()
-    key.generate_key(OpenSSL.crypto.TYPE_RSA, 1024)
-    cert = OpenSSL.crypto.X509()
-    cert.set_serial_number(357)
-    cert.get_subject().CN = "test"
-    cert.set_issuer(cert.get_subject())
-    cert.gmtime_adj_notBefore(not_before)
-    cert.gmtime_adj_notAfter(not_after)
-    cert.set_pubkey(key)
-    cert.sign(key, "sha256")
-    return OpenSSL.crypto.dump_certificate(OpenSSL.crypto.FILETYPE_PEM, cert)
-
-def _generate_csr(cn, san):
-    """Generates a csr for testing purposes"""
-    key = OpenSSL.crypto.PKey()
-    key.generate_key(OpenSSL.crypto.TYPE_RSA, 1024)
-    req = OpenSSL.crypto.X509Req()
-    if cn:
-        req.get_subject().CN = cn
-    if san:
-        sn = ([OpenSSL.crypto.X509Extension("subjectAltName", False, san)])
-        req.add_extensions(sn)
-    req.set_pubkey(key)
-    req.sign(key, "sha256")
-    return OpenSSL.crypto.dump_certificate_request(
-        OpenSSL.crypto.FILETYPE_PEM, req)
+    """Generates a certificate in a file for testing purposes
+
+    Signing a certificate is not free, and the tests reuse the same
+    date windows over and over, so the results are cached. The time the
+    certificate was generated is recorded, so that tests can compute
+    the expected dates without racing the clock.
+    """
+    try:
+        return _cert_cache[(not_before, not_after)]
+    except KeyError:
+        key = _get_key()
+        name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, u'test')])
+        # certificate dates have second resolution
+        now = datetime.utcnow().replace(microsecond=0)
+        cert = (x509.CertificateBuilder()
+                .subject_name(name)
+                .issuer_name(name)
+                .serial_number(357)
+                .public_key(key.public_key())
+                .not_valid_before(now + timedelta(seconds=not_before))
+                .not_valid_after(now + timedelta(seconds=not_after))
+                .sign(key, hashes.SHA256(), default_backend()))
+        pem = cert.public_bytes(serialization.Encoding.PEM)
+        _cert_cache[(not_before, not_after)] = pem
+        _cert_generated_at[(not_before, not_after)] = now
+        return pem
+
+# the most used date windows, frozen once at import time
+_EXPIRING_CERT = _generate_certificate(-10800, 432000)
+_LONG_LIVED_CERT = _generate_certificate(-10800, 15552000)
+
+def _store_cert(name, csr, not_before, not_after, status):
+    """Stores a certificate with the specified dates and status
+
+    The status is set before the save, so that each certificate is
+    only written to disk once.
+    """
+    cert = bigacme.cert.Certificate.new('Common', name, csr, 'http-01')
+    cert.cert = _generate_certificate(not_before, not_after)
+    cert.status = status
+    cert.save()
+    return cert
 
 def test_get_certs_that_need_action():
     configtp = namedtuple('Config', ['cm_renewal_days', 'cm_delayed_days'])
@@ -61,28 +66,15 @@ def test_get_certs_that_need_action():
     csr = _generate_csr('commonName', 'DNS:san1,DNS:san2')
 
     # certs to be renewed
-    cert_tbr1 = bigacme.cert.Certificate.new('Common', 'cert_tbr1', csr, 'http-01')
-    cert_tbr1.cert = _generate_certificate(-90800, 4320)
-    cert_tbr1.mark_as_installed()
-    cert_tbr2 = bigacme.cert.Certificate.new('Common', 'cert_tbr2', csr, 'http-01')
-    cert_tbr2.cert = _generate_certificate(-9320000, 90800)
-    cert_tbr2.mark_as_installed()
+    _store_cert('cert_tbr1', csr, -90800, 4320, 'Installed')
+    _store_cert('cert_tbr2', csr, -9320000, 90800, 'Installed')
 
     # certs to be installed
-    cert_tbi1 = bigacme.cert.Certificate.new('Common', 'cert_tbi1', csr, 'http-01')
-    cert_tbi1.cert = _generate_certificate(-995700, 1923200)
-    cert_tbi1.status = 'To be installed'
-    cert_tbi1.save()
-
-    cert_tbi2 = bigacme.cert.Certificate.new('Common', 'cert_tbi2', csr, 'http-01')
-    cert_tbi2.cert = _generate_certificate(-999700, 9123200)
-    cert_tbi2.status = 'To be installed'
-    cert_tbi2.save()
+    _store_cert('cert_tbi1', csr, -995700, 1923200, 'To be installed')
+    _store_cert('cert_tbi2', csr, -999700, 9123200, 'To be installed')
 
     # cert that neither
-    cert_tbnothin = bigacme.cert.Certificate.new('Common', 'cert_tbnothin', csr, 'http-01')
-    cert_tbnothin.cert = _generate_certificate(-29123200, 29123200)
-    cert_tbnothin.mark_as_installed()
+    _store_cert('cert_tbnothin', csr, -29123200, 29123200, 'Installed')
 
     # random file in folder
     with open('./cert/not_json.json', 'w') as open_file:
@@ -100,35 +92,29 @@ def test_get_certs_that_need_action():
 
 def test_cert_about_to_expire():
     """Tests if a certificate about to expires is detected"""
-    cert = _generate_certificate(-10800, 432000)
-    not_after_str, _ = bigacme.cert._get_cert_dates(cert)
+    not_after_str, _ = bigacme.cert._get_cert_dates(_EXPIRING_CERT)
     assert bigacme.cert._check_if_cert_about_to_expire(not_after_str, 14)
 
 def test_cert_not_about_to_expire():
     """Tests if a certificate not about to expire is not detected"""
-    cert = _generate_certificate(-10800, 15552000)
-    not_after_str, _ = bigacme.cert._get_cert_dates(cert)
+    not_after_str, _ = bigacme.cert._get_cert_dates(_LONG_LIVED_CERT)
     assert not bigacme.cert._check_if_cert_about_to_expire(not_after_str, 14)
 
 def test_get_cert_dates():
-    cert = _generate_certificate(-10800, 15552000)
-    actual_nva, actual_nvb = bigacme.cert._get_cert_dates(cert)
-    expected_nva = (datetime.today().utcnow() +
-                    timedelta(seconds=15552000)).strftime('%Y-%m-%dT%H:%M:%S')
-    expected_nvb = (datetime.today().utcnow() +
-                    timedelta(seconds=-10800)).strftime('%Y-%m-%dT%H:%M:%S')
+    actual_nva, actual_nvb = bigacme.cert._get_cert_dates(_LONG_LIVED_CERT)
+    now = _cert_generated_at[(-10800, 15552000)]
+    expected_nva = (now + timedelta(seconds=15552000)).strftime('%Y-%m-%dT%H:%M:%S')
+    expected_nvb = (now + timedelta(seconds=-10800)).strftime('%Y-%m-%dT%H:%M:%S')
     assert actual_nva == expected_nva
     assert actual_nvb == expected_nvb
 
 def test_delete_expired_backups():
-    cert = _generate_certificate(-10800, 15552000)
-    expired_cert = _generate_certificate(-10800, -10)
-    with open('./cert/backup/cert', 'w') as open_file:
-        open_file.write(cert)
-    with open('./cert/backup/expired_cert', 'w') as open_file:
-        open_file.write(expired_cert)
-    with open('./cert/backup/not_a_cert', 'w') as open_file:
-        open_file.write('this is not a cert')
+    backups = [('cert', _LONG_LIVED_CERT),
+               ('expired_cert', _generate_certificate(-10800, -10)),
+               ('not_a_cert', 'this is not a cert')]
+    for filename, content in backups:
+        with open('./cert/backup/%s' % filename, 'wb') as open_file:
+            open_file.write(content)
     bigacme.cert.delete_expired_backups()
     assert os.path.isfile('./cert/backup/cert')
     assert not os.path.isfile('./cert/backup/expired_cert')
@@ -141,87 +127,68 @@ def test__init__certificate():
     assert cert.path == './cert/%s_%s.json' % ('Partition', 'Name')
     assert cert.validation_method == 'http-01'
 
-def test_new_certificate():
-    csr = _generate_csr('common-name', 'DNS:san1,DNS:san2')
+@pytest.mark.parametrize('cn,san,expected_hostnames', [
+    ('common-name', 'DNS:san1,DNS:san2', ['common-name', 'san1', 'san2']),
+    (None, 'DNS:san', ['san']),
+    ('common-name', None, ['common-name']),
+    # same name both in CN and SAN should not result in a duplicate
+    ('common-name', 'DNS:san1,DNS:common-name,DNS:san2', ['common-name', 'san1', 'san2']),
+])
+def test_new_certificate(cn, san, expected_hostnames):
+    csr = _generate_csr(cn, san)
     cert = bigacme.cert.Certificate.new('Partition', 'test_new_certificate', csr, 'dns-01')
     assert cert.partition == 'Partition'
     assert cert.name == 'test_new_certificate'
     assert cert.csr == csr
     assert cert.validation_method == 'dns-01'
-    assert 'common-name' and 'san1' and 'san2' in cert.hostnames
-
-def test_new_certificate_no_cn():
-    csr = _generate_csr(None, 'DNS:san')
-    cert = bigacme.cert.Certificate.new('Partition', 'test_new_certificate_no_cn', csr, 'http-01')
-    assert cert.csr == csr
-    assert cert.hostnames == ['san']
-
-def test_new_certificate_no_san():
-    csr = _generate_csr('common-name', None)
-    cert = bigacme.cert.Certificate.new('Partition', 'test_new_certificate_no_san', csr, 'http-01')
-    assert cert.csr == csr
-    assert cert.hostnames == ['common-name']
-
-def test_new_certificate_commonName_in_san():
-    """Same name both in CN and SAN should not result in duplicate name in hostnames"""
-    csr = _generate_csr('common-name', 'DNS:san1,DNS:common-name,DNS:san2')
-    cert = bigacme.cert.Certificate.new('Partition', 'test_new_certificate_no_san', csr, 'http-01')
-    assert cert.csr == csr
-    assert len(cert.hostnames) == len(set(cert.hostnames))
+    assert sorted(cert.hostnames) == expected_hostnames
 
 def test_get_non_existing_cert():
     with pytest.raises(bigacme.cert.CertificateNotFoundError):
         bigacme.cert.Certificate.get('Common', 'test_get_non_existing_cert')
 
-def test_save_and_get():
-    csr = _generate_csr('common-name', 'DNS:san1,DNS:san2')
-    cert = bigacme.cert.Certificate.new('Partition', 'test_save_and_get', csr, 'http-01')
+def test_save_and_get(default_csr):
+    cert = bigacme.cert.Certificate.new('Partition', 'test_save_and_get', default_csr, 'http-01')
     cert.save()
     cert2 = bigacme.cert.Certificate.get('Partition', 'test_save_and_get')
     assert cert.__dict__ == cert2.__dict__
 
-def test_get_without_validation_method():
+def test_get_without_validation_method(default_csr):
     """Tests that a json withouth validation method fallbacks to http-01"""
-    csr = _generate_csr('common-name', 'DNS:san1,DNS:san2')
-    cert = bigacme.cert.Certificate.new('Partition', 'test_get_without_validation_method', csr,
-                                        'dns-01')
+    cert = bigacme.cert.Certificate.new('Partition', 'test_get_without_validation_method',
+                                        default_csr, 'dns-01')
     cert.save()
-    with open(cert.path, 'r+') as json_bytes:
-        json_dict = json.loads(json_bytes.read())
-        json_dict.pop('validation_method')
-        json_bytes.seek(0)
-        json_bytes.write(json.dumps(json_dict))
-        json_bytes.truncate()
+    with open(cert.path) as json_file:
+        json_dict = json.load(json_file)
+    json_dict.pop('validation_method')
+    with open(cert.path, 'w') as json_file:
+        json.dump(json_dict, json_file)
     cert2 = bigacme.cert.Certificate.get('Partition', 'test_get_without_validation_method')
     assert cert2.validation_method == 'http-01'
 
-def test_save_and_delete():
-    csr = _generate_csr('common-name', 'DNS:san1,DNS:san2')
-    cert = bigacme.cert.Certificate.new('Common', 'test_save_and_delete', csr, 'http-01')
+def test_save_and_delete(default_csr):
+    cert = bigacme.cert.Certificate.new('Common', 'test_save_and_delete', default_csr, 'http-01')
     cert.save()
     assert os.path.isfile(cert.path)
     cert.delete()
     assert not os.path.isfile(cert.path)
 
-def test_get_pem():
-    csr = _generate_csr('common-name', 'DNS:san1,DNS:san2')
-    cert = bigacme.cert.Certificate.new('Common', 'test_get_pem', csr, 'http-01')
+def test_get_pem(default_csr):
+    cert = bigacme.cert.Certificate.new('Common', 'test_get_pem', default_csr, 'http-01')
     cert.cert = _generate_certificate(0, 1555200)
     cert.chain = [_generate_certificate(0, 1555200)]
     assert cert.get_pem(False) == cert.cert
 
-def test_get_pem_with_chain():
-    csr = _generate_csr('common-name', 'DNS:san1,DNS:san2')
-    cert = bigacme.cert.Certificate.new('Common', 'test_get_pem', csr, 'http-01')
+def test_get_pem_with_chain(default_csr):
+    cert = bigacme.cert.Certificate.new('Common', 'test_get_pem', default_csr, 'http-01')
     cert.cert = _generate_certificate(0, 1555200)
     cert.chain = [_generate_certificate(0, 1555200)]
     cert_and_chain = cert.cert + cert.chain[0]
     assert cert.cert and cert.chain[0] in cert.get_pem(True)
     assert cert.get_pem(True) == cert_and_chain
 
-def test_mark_as_installed():
-    csr = _generate_csr('common-name', 'DNS:san1,DNS:san2')
-    cert = bigacme.cert.Certificate.new('Common', 'test_mark_as_installed', csr, 'http-01')
+def test_mark_as_installed(default_csr):
+    cert = bigacme.cert.Certificate.new('Common', 'test_mark_as_installed', default_csr, 'http-01')
     cert.save()
     assert cert.status == 'New'
     with open(cert.path, 'r') as json_bytes:
@@ -231,9 +198,8 @@ def test_mark_as_installed():
     with open(cert.path, 'r') as json_bytes:
         assert json.loads(json_bytes.read())['status'] == 'Installed'
 
-def test_renew():
-    csr = _generate_csr('common-name', 'DNS:san1,DNS:san2')
-    cert = bigacme.cert.Certificate.new('Common', 'test_renew', csr, 'http-01')
+def test_renew(default_csr):
+    cert = bigacme.cert.Certificate.new('Common', 'test_renew', default_csr, 'http-01')
     org_cert = _generate_certificate(0, 1555200)
     org_chain = _generate_certificate(0, 1555200)
     cert.cert, cert.chain = org_cert, org_chain
@@ -243,31 +209,28 @@ def test_renew():
     assert os.path.isfile('./cert/backup/Common_test_renew.cer')
     assert cert.status == 'To be installed'
 
-def test_old_enough():
-    csr = _generate_csr('common-name', 'DNS:san1,DNS:san2')
-    cert = bigacme.cert.Certificate.new('Common', 'test_old_enough', csr, 'http-01')
+def test_old_enough(default_csr):
+    cert = bigacme.cert.Certificate.new('Common', 'test_old_enough', default_csr, 'http-01')
     cert.cert = _generate_certificate(-1980000, 4320000)
     assert cert.old_enough(13)
 
-def test_not_old_enough():
-    csr = _generate_csr('common-name', 'DNS:san1,DNS:san2')
-    cert = bigacme.cert.Certificate.new('Common', 'test_old_enough', csr, 'http-01')
+def test_not_old_enough(default_csr):
+    cert = bigacme.cert.Certificate.new('Common', 'test_old_enough', default_csr, 'http-01')
     cert.cert = _generate_certificate(0, 4320000)
     assert not cert.old_enough(14)
 
-def test_about_to_expire():
-    csr = _generate_csr('common-name', 'DNS:san1,DNS:san2')
-    cert = bigacme.cert.Certificate.new('Common', 'test_about_to_expire', csr, 'http-01')
-    cert.cert = _generate_certificate(-10800, 432000)
+def test_about_to_expire(default_csr):
+    cert = bigacme.cert.Certificate.new('Common', 'test_about_to_expire', default_csr, 'http-01')
+    cert.cert = _EXPIRING_CERT
     assert cert.about_to_expire(14)
 
-def test_not_about_to_expire():
-    csr = _generate_csr('common-name', 'DNS:san1,DNS:san2')
-    cert = bigacme.cert.Certificate.new('Common', 'test_not_about_to_expire', csr, 'http-01')
+def test_not_about_to_expire(default_csr):
+    cert = bigacme.cert.Certificate.new('Common', 'test_not_about_to_expire', default_csr, 'http-01')
     cert.cert = _generate_certificate(-10800, 432000000)
     assert not cert.about_to_expire(14)
 
-def test_save_when_owned_by_another_user(opt_user):
+@pytest.mark.skipif(os.geteuid() != 0, reason="Not running as root")
+def test_save_when_owned_by_another_user(opt_user, default_csr):
     """
     If a certificate is issued by another user than the one who is running the renew job
     the cert file will be owned by the issuing user. This should not fail as long as we
@@ -275,10 +238,8 @@ def test_save_when_owned_by_another_user(opt_user):
 
     Here we create a csr as root and then change to a normal user and try to save it again
     """
-    if os.geteuid() != 0:
-        pytest.skip("Not running as root")
-    csr = _generate_csr('common-name', 'DNS:san1,DNS:san2')
-    cert = bigacme.cert.Certificate.new('Common', 'test_save_when_owned_by_another_user', csr,
+    import pwd
+    cert = bigacme.cert.Certificate.new('Common', 'test_save_when_owned_by_another_user', default_csr,
                                         'http-01')
     cert.save()
     uid = pwd.getpwnam(opt_user).pw_uid
@@ -1,29 +1,47 @@
 """Tests for config.py"""
 import os
-import re
-import sys
 import stat
-import shutil
-import tempfile
-import fileinput
 import logging.config
 from collections import namedtuple
 
 import pytest
 import bigacme.config
 
-ORG_CWD = os.getcwd()
-
-def setup_module(module):
-    temp_dir = tempfile.mkdtemp()
-    os.chdir(temp_dir)
-    for folder in bigacme.config.CONFIG_DIRS:
-        os.makedirs(folder)
-
-def teardown_module(module):
-    if '/tmp/' in os.getcwd():
-        shutil.rmtree(os.getcwd())
-    os.chdir(ORG_CWD)
+# the different config variants, prebuilt so that each case just
+# writes its config and reads it back, independent of the others
+_DEFAULT_CONFIG = (
+    '[Common]\n'
+    'renewal days = 20\n'
+    'delayed installation days = 5\n'
+    'include chain = True\n'
+    'account key = ./config/key.pem\n'
+    '[Load Balancer]\n'
+    'cluster = True\n'
+    'host 1 = lb1.example.com\n'
+    'host 2 = lb2.example.com\n'
+    'username = admin\n'
+    'password = password01\n'
+    'datagroup = acme_responses_dg\n'
+    'datagroup partition = Common\n'
+    '[Certificate Authority]\n'
+    'directory url = https://acme-v02.api.letsencrypt.org/directory\n'
+    'use proxy = False\n'
+    'proxy = http://proxy.example.com:8080\n')
+
+_NO_CLUSTER_CONFIG = _DEFAULT_CONFIG.replace(
+    'cluster = True', 'cluster = False').replace('host 2 = lb2.example.com\n', '')
+
+_PROXY_CONFIG = _DEFAULT_CONFIG.replace('use proxy = False', 'use proxy = True')
+
+_NO_PROXY_CONFIG = _DEFAULT_CONFIG.replace(
+    'proxy = http://proxy.example.com:8080\n', '')
+
+_PLUGIN_CONFIG = _DEFAULT_CONFIG + '[Plugin]\noption1 = yes\noption2 = no\n'
+
+def _write_configfile(config):
+    """Writes the specified config to the config file"""
+    with open(bigacme.config.CONFIG_FILE, 'w') as config_file:
+        config_file.write(config)
 
 def test_check_configfiles():
     assert not bigacme.config.check_configfiles()
@@ -46,33 +64,26 @@ def test_create_and_read_configfile():
 
     config = bigacme.config.read_configfile()
 
+    # The plugin config should be False by default
+    assert not config.plugin
+
     # the host 2 option should not be used if Cluster = False
-    for line in fileinput.input(bigacme.config.CONFIG_FILE, inplace=True):
-        sys.stdout.write(re.sub('cluster = (True|False)', 'cluster = False', line).replace(
-            'host 2 = lb2.example.com', ''))
+    _write_configfile(_NO_CLUSTER_CONFIG)
     config = bigacme.config.read_configfile()
     assert config.lb2 is None
 
     # If use proxy = True, the proxy address should be read
-    for line in fileinput.input(bigacme.config.CONFIG_FILE, inplace=True):
-        sys.stdout.write(re.sub('use proxy = (True|False)', 'use proxy = True', line))
+    _write_configfile(_PROXY_CONFIG)
     config = bigacme.config.read_configfile()
     assert config.ca_proxy == 'http://proxy.example.com:8080'
 
     # The proxy address should not be used if use proxy = False
-    for line in fileinput.input(bigacme.config.CONFIG_FILE, inplace=True):
-        sys.stdout.write(re.sub('use proxy = (True|False)', 'use proxy = False', line).replace(
-            'proxy = http://proxy.example.com:8080', ''))
+    _write_configfile(_NO_PROXY_CONFIG)
     config = bigacme.config.read_configfile()
     assert not config.ca_proxy
 
-    # The plugin config should be False by default
-    assert not config.plugin
-
     # If there is a Plugin section, the whole should be returned as config.plugin
-    plugin_config = "[Plugin]\noption1 = yes\noption2 = no"
-    with open(bigacme.config.CONFIG_FILE, 'a') as config_file:
-        config_file.write(plugin_config)
+    _write_configfile(_PLUGIN_CONFIG)
     config = bigacme.config.read_configfile()
     assert len(config.plugin) == 2
     assert config.plugin[0][1] == "yes"
@@ -89,10 +100,22 @@ def test_create_account_key():
     bigacme.config.delete_account_key(config)
     assert not os.path.isfile(config.cm_key)
 
+_applied_logconfigs = set()
+
+def _apply_logconfig(debug):
+    """Creates and applies the logconfig for the variant, once per run
+
+    fileConfig re-parses the ini file and tears down the existing
+    handlers, so each variant is only applied once.
+    """
+    if debug not in _applied_logconfigs:
+        bigacme.config.create_logconfigfile(debug)
+        logging.config.fileConfig(bigacme.config.LOG_CONFIG_FILE)
+        _applied_logconfigs.add(debug)
+
 def test_create_logconfigfile():
     """ Creates a normal logconfig file"""
-    bigacme.config.create_logconfigfile(False)
-    logging.config.fileConfig(bigacme.config.LOG_CONFIG_FILE)
+    _apply_logconfig(False)
     # root logger should be INFO and the bigacme logger nothin, but should propagate
     assert logging.getLogger().level == 20
     assert logging.getLogger('bigacme').level == 0
@@ -100,8 +123,7 @@ def test_create_logconfigfile():
 
 def test_create_logconfigfile_debug():
     """ Creates a debug logconfig file"""
-    bigacme.config.create_logconfigfile(True)
-    logging.config.fileConfig(bigacme.config.LOG_CONFIG_FILE)
+    _apply_logconfig(True)
     # root logger should be INFO and the bigacme logger DEBUG and not propagate
     assert logging.getLogger().level == 20
     assert logging.getLogger('bigacme').level == 10